@@ -16,6 +16,11 @@ class Settings(BaseSettings):
 
     # gRPC Configuration
     GRPC_HOST: str = os.getenv("GRPC_HOST", "localhost:50051")
+    GRPC_CHANNELS: int = int(os.getenv("GRPC_CHANNELS", "4"))
+
+    # Ranking result cache
+    RANK_CACHE_SIZE: int = int(os.getenv("RANK_CACHE_SIZE", "10000"))
+    RANK_CACHE_TTL_SECONDS: float = float(os.getenv("RANK_CACHE_TTL_SECONDS", "30"))
 
     # Database Configuration
     DATABASE_URL: str = os.getenv(
@@ -2,15 +2,23 @@
 Database configuration with SQLAlchemy ORM models.
 """
 
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Index
+from sqlalchemy import create_engine, make_url, Column, Integer, String, Float, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 from config import settings
 
+def _database_url(url: str):
+    """Route plain PostgreSQL URLs to the psycopg (v3) driver."""
+    parsed = make_url(url)
+    if parsed.drivername in ("postgresql", "postgresql+psycopg2"):
+        parsed = parsed.set(drivername="postgresql+psycopg")
+    return parsed
+
+
 # Database engine
 engine = create_engine(
-    settings.DATABASE_URL,
+    _database_url(settings.DATABASE_URL),
     echo=settings.DEBUG,
     pool_pre_ping=True,  # Verify connections before using
     pool_size=10,
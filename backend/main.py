@@ -4,15 +4,18 @@ FastAPI wrapper for FeedRanker gRPC service with REST API, monitoring, and async
 
 from contextlib import asynccontextmanager
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
+import collections
+import itertools
 import logging
 
-from fastapi import FastAPI, HTTPException, Depends, Query, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Query, Body
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 import grpc
 import asyncio
+from cachetools import TTLCache
 
 import feed_ranker_pb2
 import feed_ranker_pb2_grpc
@@ -52,11 +55,22 @@ class RankingResponse(BaseModel):
     timestamp: datetime
 
 
+class RankedList(BaseModel):
+    ranked_items: List[ItemScore]
+
+
+class RankingBatchResponse(BaseModel):
+    results: List[RankedList]
+    latency_ms: float
+    timestamp: datetime
+
+
 class RankingPayload(BaseModel):
     user_id: str
     item_ids: List[str] = Field(..., min_items=1, max_items=1000)
     user_features: Optional[dict] = Field(default_factory=dict)
     context_features: Optional[dict] = Field(default_factory=dict)
+    top_k: Optional[int] = Field(default=None, ge=1)
 
 
 class ModelStatus(BaseModel):
@@ -78,40 +92,141 @@ class HealthCheck(BaseModel):
 # gRPC client setup
 # ─────────────────────────────────────────────────
 
-grpc_channel = None
-grpc_stub = None
-model_status_cache = {
-    "total_requests": 0,
-    "total_latency_ms": 0.0,
-    "last_request_at": None,
-}
+class ChannelPool:
+    """Round-robin over several gRPC channels so requests don't share one HTTP/2 connection."""
+
+    def __init__(self, target: str, size: int = 4):
+        # A distinct channel arg per channel plus a local subchannel pool keeps
+        # gRPC from collapsing them back onto a single connection.
+        self.channels = [
+            grpc.aio.insecure_channel(
+                target,
+                options=[
+                    ("grpc.use_local_subchannel_pool", 1),
+                    ("feedranker.channel_id", i),
+                ],
+            )
+            for i in range(size)
+        ]
+        self.stubs = [feed_ranker_pb2_grpc.FeedRankerStub(ch) for ch in self.channels]
+        self._counter = itertools.count()
+
+    def pick(self) -> feed_ranker_pb2_grpc.FeedRankerStub:
+        return self.stubs[next(self._counter) % len(self.stubs)]
+
+    async def close(self):
+        for ch in self.channels:
+            await ch.close()
+
+
+class RequestStats:
+    """
+    In-process request counters without read-modify-write updates.
+
+    The request count comes from an itertools.count, whose ``next`` is atomic
+    in CPython, and latencies go to a bounded ring buffer, so averages cover
+    the most recent ``window`` requests.
+    """
+
+    def __init__(self, window: int = 4096):
+        self._counter = itertools.count(1)
+        self._latencies = collections.deque(maxlen=window)
+        self.total_requests = 0
+        self.last_request_at: Optional[datetime] = None
+
+    def record(self, latency_ms: float):
+        self.total_requests = next(self._counter)
+        self._latencies.append(latency_ms)
+        self.last_request_at = datetime.utcnow()
+
+    def avg_latency_ms(self) -> float:
+        ring = list(self._latencies)
+        return sum(ring) / len(ring) if ring else 0.0
+
+    def min_latency_ms(self) -> float:
+        return min(self._latencies, default=0.0)
+
+    def max_latency_ms(self) -> float:
+        return max(self._latencies, default=0.0)
+
+
+grpc_pool: Optional[ChannelPool] = None
+request_stats = RequestStats()
+
+# Ranking metrics are queued per request and written to the database in batches
+METRIC_QUEUE_SIZE = 10000
+METRIC_BATCH_SIZE = 100
+METRIC_FLUSH_SECONDS = 0.2
+metric_queue: Optional[asyncio.Queue] = None
+
+# Upper bound on payloads accepted by /rank_batch
+MAX_BATCH_REQUESTS = 100
+
+# Recently ranked payloads, so repeated hot-feed requests skip gRPC
+rank_cache = TTLCache(maxsize=settings.RANK_CACHE_SIZE, ttl=settings.RANK_CACHE_TTL_SECONDS)
 
 
 async def init_grpc():
-    """Initialize gRPC channel to ranking service."""
-    global grpc_channel, grpc_stub
+    """Initialize gRPC channel pool to ranking service."""
+    global grpc_pool
     try:
-        # Use insecure channel for local development
-        grpc_channel = grpc.aio.insecure_channel(settings.GRPC_HOST)
-        grpc_stub = feed_ranker_pb2_grpc.FeedRankerStub(grpc_channel)
-        logger.info(f"gRPC connected to {settings.GRPC_HOST}")
+        # Use insecure channels for local development
+        grpc_pool = ChannelPool(settings.GRPC_HOST, settings.GRPC_CHANNELS)
+        logger.info(f"gRPC connected to {settings.GRPC_HOST} ({settings.GRPC_CHANNELS} channels)")
     except Exception as e:
         logger.error(f"Failed to connect to gRPC: {e}")
-        grpc_stub = None
+        grpc_pool = None
+
+
+def build_rank_request(payload: RankingPayload) -> feed_ranker_pb2.RankRequest:
+    """Convert an API payload into a gRPC RankRequest."""
+    # extend/update fill the repeated and map fields in bulk instead of
+    # going through keyword coercion
+    request = feed_ranker_pb2.RankRequest()
+    request.user_id = payload.user_id
+    request.item_ids.extend(payload.item_ids)
+    request.user_features.update(payload.user_features or {})
+    request.context_features.update(payload.context_features or {})
+    request.top_k = payload.top_k or 0
+    return request
+
+
+def rank_cache_key(payload: RankingPayload):
+    """Cache key covering everything that affects a ranking, or None if unhashable."""
+    key = (
+        payload.user_id,
+        tuple(payload.item_ids),
+        tuple(sorted((payload.user_features or {}).items())),
+        tuple(sorted((payload.context_features or {}).items())),
+        payload.top_k,
+    )
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
 
 
 async def close_grpc():
-    """Close gRPC channel."""
-    global grpc_channel
-    if grpc_channel:
-        await grpc_channel.close()
+    """Close gRPC channels."""
+    if grpc_pool:
+        await grpc_pool.close()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Manage app lifecycle: startup and shutdown."""
+    global metric_queue
     await init_grpc()
+    drain_task = None
+    if DB_ENABLED:
+        metric_queue = asyncio.Queue(maxsize=METRIC_QUEUE_SIZE)
+        drain_task = asyncio.create_task(drain_metrics(metric_queue))
     yield
+    if drain_task:
+        # Sentinel: flush whatever is still queued, then stop
+        await metric_queue.put(None)
+        await drain_task
     await close_grpc()
 
 
@@ -124,6 +239,7 @@ app = FastAPI(
     description="Scalable feed ranking service with LambdaMART + Deep CTR ensemble",
     version="1.0.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware
@@ -171,24 +287,19 @@ async def health_check():
 @app.get("/status", response_model=ModelStatus)
 async def model_status(db: Session = Depends(get_db)):
     """Get current model and service status."""
-    avg_latency = (
-        model_status_cache["total_latency_ms"] / max(model_status_cache["total_requests"], 1)
-    )
     return ModelStatus(
-        lambdamart_loaded=grpc_stub is not None,
-        ctr_loaded=grpc_stub is not None,
-        gRPC_connected=grpc_stub is not None,
-        last_request_at=model_status_cache["last_request_at"],
-        total_requests=model_status_cache["total_requests"],
-        avg_latency_ms=avg_latency,
+        lambdamart_loaded=grpc_pool is not None,
+        ctr_loaded=grpc_pool is not None,
+        gRPC_connected=grpc_pool is not None,
+        last_request_at=request_stats.last_request_at,
+        total_requests=request_stats.total_requests,
+        avg_latency_ms=request_stats.avg_latency_ms(),
     )
 
 
 @app.post("/rank", response_model=RankingResponse)
 async def rank_items(
     payload: RankingPayload,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
 ):
     """
     Rank items using ensemble of LambdaMART and Deep CTR models.
@@ -199,51 +310,98 @@ async def rank_items(
     Returns:
         RankingResponse with ranked items and latency
     """
-    if grpc_stub is None:
+    import time
+    start_time = time.perf_counter()
+
+    cache_key = None
+    if len(payload.item_ids) == 1:
+        # A single item needs no ranking: skip the gRPC round trip
+        ranked_items = [{"item_id": payload.item_ids[0], "score": 1.0}]
+    else:
+        cache_key = rank_cache_key(payload)
+        ranked_items = rank_cache.get(cache_key) if cache_key is not None else None
+
+    if ranked_items is None:
+        if grpc_pool is None:
+            raise HTTPException(status_code=503, detail="Ranking service unavailable")
+
+        try:
+            # Call gRPC service
+            response = await grpc_pool.pick().Rank(build_rank_request(payload))
+
+            # Build plain dicts and return the response directly: this skips
+            # per-item Pydantic validation of RankingResponse on the hot path
+            ranked_items = [
+                {"item_id": item.item_id, "score": item.score}
+                for item in response.ranked_items
+            ]
+
+        except grpc.RpcError as e:
+            logger.error(f"gRPC error: {e}")
+            raise HTTPException(status_code=503, detail="Ranking service error")
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+            raise HTTPException(status_code=500, detail="Internal server error")
+
+        if cache_key is not None:
+            rank_cache[cache_key] = ranked_items
+
+    latency_ms = (time.perf_counter() - start_time) * 1000
+    record_ranking(payload, latency_ms)
+
+    return ORJSONResponse({
+        "ranked_items": ranked_items,
+        "latency_ms": latency_ms,
+        "timestamp": datetime.utcnow().isoformat(),
+    })
+
+
+@app.post("/rank_batch", response_model=RankingBatchResponse)
+async def rank_items_batch(
+    payloads: List[RankingPayload] = Body(..., min_length=1, max_length=MAX_BATCH_REQUESTS),
+):
+    """
+    Rank several independent requests over a single gRPC stream.
+
+    The ranking server scores requests that arrive together in one model
+    call, so this amortizes per-call overhead across the batch.
+
+    Args:
+        payloads: list of RankingPayload, ranked independently
+
+    Returns:
+        RankingBatchResponse with one ranked list per payload, in order
+    """
+    if grpc_pool is None:
         raise HTTPException(status_code=503, detail="Ranking service unavailable")
 
     try:
         import time
-        start_time = time.time()
-
-        # Build gRPC request
-        request = feed_ranker_pb2.RankRequest(
-            user_id=payload.user_id,
-            item_ids=payload.item_ids,
-            user_features=payload.user_features or {},
-            context_features=payload.context_features or {},
-        )
-
-        # Call gRPC service
-        response = await grpc_stub.Rank(request)
-
-        latency_ms = (time.time() - start_time) * 1000
-
-        # Update cache
-        model_status_cache["total_requests"] += 1
-        model_status_cache["total_latency_ms"] += latency_ms
-        model_status_cache["last_request_at"] = datetime.utcnow()
-
-        # Store request in database asynchronously (if enabled)
-        if DB_ENABLED and db:
-            background_tasks.add_task(
-                store_ranking_request,
-                db,
-                payload.user_id,
-                payload.item_ids,
-                latency_ms,
-            )
+        start_time = time.perf_counter()
 
-        ranked_items = [
-            ItemScore(item_id=item.item_id, score=item.score)
-            for item in response.ranked_items
+        # Build every request up front: conversion errors raised inside
+        # grpc's request-consumer task would only cancel the call
+        requests = [build_rank_request(p) for p in payloads]
+        call = grpc_pool.pick().RankBatch(iter(requests))
+        results = [
+            {
+                "ranked_items": [
+                    {"item_id": item.item_id, "score": item.score}
+                    for item in response.ranked_items
+                ]
+            }
+            async for response in call
         ]
 
-        return RankingResponse(
-            ranked_items=ranked_items,
-            latency_ms=latency_ms,
-            timestamp=datetime.utcnow(),
-        )
+        latency_ms = (time.perf_counter() - start_time) * 1000
+        for payload in payloads:
+            record_ranking(payload, latency_ms)
+
+        return ORJSONResponse({
+            "results": results,
+            "latency_ms": latency_ms,
+            "timestamp": datetime.utcnow().isoformat(),
+        })
 
     except grpc.RpcError as e:
         logger.error(f"gRPC error: {e}")
@@ -279,29 +437,36 @@ async def get_latency_metrics(
 
 
 @app.get("/metrics/summary")
-async def get_metrics_summary(db: Session = Depends(get_db)):
+async def get_metrics_summary(
+    window_minutes: int = Query(60, ge=1, le=7 * 24 * 60),
+    db: Session = Depends(get_db),
+):
     if not DB_ENABLED or db is None:
         return {
-            "total_requests": model_status_cache["total_requests"],
-            "avg_latency_ms": model_status_cache["total_latency_ms"] / max(model_status_cache["total_requests"], 1),
-            "min_latency_ms": 0,
-            "max_latency_ms": 0
+            "total_requests": request_stats.total_requests,
+            "avg_latency_ms": request_stats.avg_latency_ms(),
+            "min_latency_ms": request_stats.min_latency_ms(),
+            "max_latency_ms": request_stats.max_latency_ms(),
         }
-    """Get summary statistics of ranking requests."""
+    """Get summary statistics of ranking requests in the recent window."""
     from sqlalchemy import func
-    
+
+    # Bounding created_at lets Postgres use its index instead of scanning
+    # the whole metrics table
+    since = datetime.utcnow() - timedelta(minutes=window_minutes)
     summary = db.query(
         func.count(RankingMetric.id).label("total_requests"),
         func.avg(RankingMetric.latency_ms).label("avg_latency"),
         func.min(RankingMetric.latency_ms).label("min_latency"),
         func.max(RankingMetric.latency_ms).label("max_latency"),
-    ).first()
+    ).filter(RankingMetric.created_at > since).first()
 
     return {
         "total_requests": summary.total_requests or 0,
-        "avg_latency_ms": round(float(summary.avg_latency) or 0, 2),
-        "min_latency_ms": round(float(summary.min_latency) or 0, 2),
-        "max_latency_ms": round(float(summary.max_latency) or 0, 2),
+        "avg_latency_ms": round(float(summary.avg_latency or 0), 2),
+        "min_latency_ms": round(float(summary.min_latency or 0), 2),
+        "max_latency_ms": round(float(summary.max_latency or 0), 2),
+        "window_minutes": window_minutes,
         "timestamp": datetime.utcnow(),
     }
 
@@ -310,24 +475,61 @@ async def get_metrics_summary(db: Session = Depends(get_db)):
 # Background tasks
 # ─────────────────────────────────────────────────
 
-def store_ranking_request(
-    db: Session,
-    user_id: str,
-    item_ids: List[str],
-    latency_ms: float,
-):
-    """Store ranking request in database for auditing and analytics."""
+def record_ranking(payload: RankingPayload, latency_ms: float):
+    """Update in-process stats and queue the metric for the database writer."""
+    request_stats.record(latency_ms)
+    if metric_queue is None:
+        return
+    try:
+        metric_queue.put_nowait({
+            "user_id": payload.user_id,
+            "num_items": len(payload.item_ids),
+            "latency_ms": latency_ms,
+            "created_at": datetime.utcnow(),
+        })
+    except asyncio.QueueFull:
+        logger.warning("Metric queue full, dropping ranking metric")
+
+
+def store_ranking_metrics(rows: List[dict]):
+    """Insert a batch of ranking metrics in a single transaction."""
+    db = SessionLocal()
     try:
-        metric = RankingMetric(
-            user_id=user_id,
-            num_items=len(item_ids),
-            latency_ms=latency_ms,
-        )
-        db.add(metric)
+        db.execute(RankingMetric.__table__.insert(), rows)
         db.commit()
     except Exception as e:
-        logger.error(f"Failed to store metric: {e}")
+        logger.error(f"Failed to store {len(rows)} metrics: {e}")
         db.rollback()
+    finally:
+        db.close()
+
+
+async def drain_metrics(queue: asyncio.Queue):
+    """
+    Write queued metrics to the database, one commit per batch.
+
+    A batch is flushed once it holds METRIC_BATCH_SIZE rows or
+    METRIC_FLUSH_SECONDS after its first row arrived. A ``None`` sentinel
+    flushes the pending batch and stops the loop.
+    """
+    loop = asyncio.get_running_loop()
+    done = False
+    while not done:
+        row = await queue.get()
+        if row is None:
+            break
+        rows = [row]
+        deadline = loop.time() + METRIC_FLUSH_SECONDS
+        try:
+            while len(rows) < METRIC_BATCH_SIZE:
+                row = await asyncio.wait_for(queue.get(), deadline - loop.time())
+                if row is None:
+                    done = True
+                    break
+                rows.append(row)
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.to_thread(store_ranking_metrics, rows)
 
 
 if __name__ == "__main__":
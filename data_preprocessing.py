@@ -2,21 +2,22 @@
 """
 data_preprocessing.py
 
-Preprocess MIND behaviors + news → one Parquet of (user_id, news_id, impression_id,
- impressions, clicks, ctr, avg_hour, category_idx, title_len, abstract_len).
+Preprocess MIND behaviors + news → a ZSTD Parquet dataset, partitioned by
+category_idx, of (user_id, news_id, impression_id, impressions, clicks, ctr,
+avg_hour, category_idx, title_len, abstract_len).
 
 Handles mixed one- and two-digit hours, avoids OOM via shuffle tuning & repartitioning.
 """
 
 import argparse
 import logging
+from itertools import chain
 
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import (
     col, explode, split, avg, sum as _sum, length,
-    lit, to_timestamp, coalesce, when
+    lit, to_timestamp, coalesce, when, create_map
 )
-from pyspark.ml.feature import StringIndexer
 
 
 def parse_args():
@@ -32,9 +33,20 @@ def parse_args():
     p.add_argument("--date-format",
                    default="M/d/yyyy h:mm:ss a",
                    help="Use M/d/yyyy h:mm:ss a to accept 1- or 2-digit hours")
+    p.add_argument("--checkpoint-dir",
+                   default="/tmp/feedranker-checkpoints",
+                   help="where to checkpoint the aggregated features")
     return p.parse_args()
 
 
+def delete_path(spark, path):
+    """Recursively delete ``path`` through the Hadoop FileSystem API."""
+    jvm = spark.sparkContext._jvm
+    hpath = jvm.org.apache.hadoop.fs.Path(path)
+    fs = hpath.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+    fs.delete(hpath, True)
+
+
 def main():
     args = parse_args()
 
@@ -47,6 +59,9 @@ def main():
              .appName("FeedRankerPreprocessing-MIND")
              .config("spark.memory.fraction", "0.6")       # MUST be a string
              .getOrCreate())
+    # per-run checkpoint directory, removed once the output is written
+    ckpt_dir = f"{args.checkpoint_dir.rstrip('/')}/{spark.sparkContext.applicationId}"
+    spark.sparkContext.setCheckpointDir(ckpt_dir)
 
     # tune shuffle partitions based on cores
     cores = spark.sparkContext.defaultParallelism
@@ -54,6 +69,12 @@ def main():
     log.info(f"Setting spark.sql.shuffle.partitions = {shuffle_parts}")
     spark.conf.set("spark.sql.shuffle.partitions", str(shuffle_parts))  # MUST be a string
 
+    # let AQE coalesce small shuffle partitions and split skewed ones
+    spark.conf.set("spark.sql.adaptive.enabled", "true")
+    spark.conf.set("spark.sql.adaptive.coalescePartitions.enabled", "true")
+    spark.conf.set("spark.sql.adaptive.skewJoin.enabled", "true")
+    spark.conf.set("spark.sql.execution.arrow.pyspark.enabled", "true")
+
     # ----------------------------------------------------------------
     # 1) Load + parse behaviors
     # ----------------------------------------------------------------
@@ -94,12 +115,11 @@ def main():
         .drop("pair", "impressions")
     )
 
-    # bound per-partition data for the big groupBy
-    exp = exp.repartition(shuffle_parts, "imp_id")
-
     # ----------------------------------------------------------------
     # 3) Aggregate per impression
     # ----------------------------------------------------------------
+    # no explicit repartition: the aggregate combines map-side before its
+    # single shuffle, and AQE sizes the post-shuffle partitions
     log.info("Aggregating features per (user,news,imp_id)")
     feat = (exp.groupBy("user_id", "news_id", "imp_id")
                .agg(
@@ -115,6 +135,11 @@ def main():
                )
     )
 
+    # materialize the aggregate and cut its lineage so the join/write never
+    # re-reads behaviors.tsv or replays the explode on retry
+    log.info("Checkpointing aggregated features")
+    feat = feat.checkpoint(eager=True)
+
     # ----------------------------------------------------------------
     # 4) Load + featurize news metadata
     # ----------------------------------------------------------------
@@ -132,14 +157,18 @@ def main():
         length(col("abstract")).alias("abstract_len")
     )
 
+    # the category vocabulary is tiny: collect it on the driver and index
+    # with a literal map instead of fitting a StringIndexer
     log.info("Indexing categories")
-    idxer = StringIndexer(
-        inputCol="category",
-        outputCol="category_idx",
-        handleInvalid="keep"
-    ).fit(news_feats)
-
-    news_idx = (idxer.transform(news_feats)
+    cats = sorted(r.category for r in
+                  news.select("category").distinct().collect()
+                  if r.category is not None)
+    cat_map = create_map(*chain.from_iterable(
+        (lit(c), lit(float(i))) for i, c in enumerate(cats)
+    ))
+
+    news_idx = (news_feats
+                    .withColumn("category_idx", cat_map[col("category")])
                     .select("news_id", "category_idx", "title_len", "abstract_len"))
 
     # ----------------------------------------------------------------
@@ -154,11 +183,19 @@ def main():
                      "avg_hour": 0.0
                  }))
 
-    log.info("Repartitioning to 200 files and writing to Parquet")
-    (final.repartition(200)
+    # count-based repartition keeps the write spread over shuffle_parts
+    # tasks; hashing on category_idx would give one task per category
+    log.info(f"Writing ZSTD Parquet partitioned by category_idx from {shuffle_parts} tasks")
+    (final.repartition(shuffle_parts)
           .write.mode("overwrite")
+          .option("compression", "zstd")
+          .option("parquet.enable.dictionary", "true")
+          .partitionBy("category_idx")
           .parquet(args.output))
 
+    log.info(f"Removing checkpoint directory {ckpt_dir}")
+    delete_path(spark, ckpt_dir)
+
     log.info("Done.")
     spark.stop()
 
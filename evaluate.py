@@ -5,22 +5,29 @@ import pandas as pd
 from sklearn.metrics import ndcg_score
 import tensorflow as tf
 
+FEATURE_COLUMNS = ["impressions", "avg_hour", "ctr"]
+
+def load_features(feat_path):
+    # Arrow-backed columns skip pandas' NumPy block consolidation, so the
+    # feature matrix below is the only copy made after decoding Parquet
+    df = pd.read_parquet(feat_path, columns=FEATURE_COLUMNS, engine="pyarrow",
+                         dtype_backend="pyarrow")
+    X = df[["impressions", "avg_hour"]].to_numpy(dtype=np.float32)
+    y = df["ctr"].to_numpy(dtype=np.float64)
+    return X, y
+
 def eval_lambdamart(model_path, feat_path):
-    df = pd.read_parquet(feat_path)
-    X = df[["impressions", "avg_hour"]]
-    y = df["ctr"]
+    X, y = load_features(feat_path)
     bst = lgb.Booster(model_file=model_path)
     y_pred = bst.predict(X)
-    return ndcg_score([y.values], [y_pred], k=10)
+    return ndcg_score([y], [y_pred], k=10)
 
 def eval_ctr(model_dir, feat_path):
     model = tf.keras.models.load_model(model_dir)
-    df = pd.read_parquet(feat_path)
-    X = df[["impressions", "avg_hour"]].values
+    X, y_true = load_features(feat_path)
     # treat predicted probabilities as scores
     y_pred = model.predict(X).flatten()
     # use ctr as target relevance
-    y_true = df["ctr"].values
     return ndcg_score([y_true], [y_pred], k=10)
 
 if __name__=="__main__":
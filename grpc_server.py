@@ -1,19 +1,33 @@
 # grpc_server.py
+import asyncio
+import hashlib
 import grpc
 from concurrent import futures
 import numpy as np
 import os
+import threading
 import feed_ranker_pb2, feed_ranker_pb2_grpc
 
 LAMBDA_MODEL_PATH = "lambdamart.txt"
 CTR_MODEL_PATH    = "deepctr_model"
+CTR_TFLITE_PATH   = CTR_MODEL_PATH + ".tflite"  # int8 export written by train_ctr.py
+MAX_WORKERS       = os.cpu_count() or 4
+# RankBatch scores requests arriving within this window in one model call
+BATCH_MAX_REQUESTS   = 64
+BATCH_WINDOW_SECONDS = 0.005
 
 # Check if models exist
 MODELS_AVAILABLE = os.path.exists(LAMBDA_MODEL_PATH) and os.path.exists(CTR_MODEL_PATH)
 
 if MODELS_AVAILABLE:
+    # Parallelism comes from the MAX_WORKERS inference threads; keep each
+    # model call single-threaded so the two levels don't oversubscribe cores.
+    # OpenMP reads this once, so it must be set before lightgbm loads.
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
     import lightgbm as lgb
     import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(1)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
     print("Loading trained models...")
 else:
     print("⚠️  WARNING: Models not found. Running in DEMO mode with random scores.")
@@ -22,52 +36,165 @@ else:
     print("   2. Run train_lambdamart.py")
     print("   3. Run train_ctr.py")
 
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+def rank_order(scores, top_k=0):
+    """Indices of ``scores`` in descending order, truncated to ``top_k`` if set."""
+    neg = -scores
+    if 0 < top_k < len(scores):
+        idx = np.argpartition(neg, top_k)[:top_k]
+        return idx[np.argsort(neg[idx], kind="stable")]
+    return np.argsort(neg, kind="stable")
+
 class FeedRankerServicer(feed_ranker_pb2_grpc.FeedRankerServicer):
     def __init__(self):
         if MODELS_AVAILABLE:
             self.lm = lgb.Booster(model_file=LAMBDA_MODEL_PATH)
-            self.ctr = tf.keras.models.load_model(CTR_MODEL_PATH)
+            self.use_tflite = os.path.exists(CTR_TFLITE_PATH)
+            if self.use_tflite:
+                # TFLite interpreters are not thread-safe: one per executor thread
+                print(f"Serving CTR model from {CTR_TFLITE_PATH}")
+                self.ctr = None
+                self._tls = threading.local()
+            else:
+                self.ctr = tf.keras.models.load_model(CTR_MODEL_PATH)
+                # trace the CTR forward pass once so requests skip Keras' predict() dispatch
+                self._ctr_fn = tf.function(
+                    lambda x: self.ctr(x, training=False),
+                    input_signature=[tf.TensorSpec([None, 2], tf.float32)],
+                )
+                self._ctr_fn(tf.zeros((1, 2), dtype=tf.float32))
+            # model calls run off the event loop; both release the GIL
+            self._pool = futures.ThreadPoolExecutor(max_workers=MAX_WORKERS)
             self.demo_mode = False
         else:
             self.lm = None
             self.ctr = None
             self.demo_mode = True
 
-    def Rank(self, request, context):
+    def _interpreter(self):
+        itp = getattr(self._tls, "interpreter", None)
+        if itp is None:
+            itp = tf.lite.Interpreter(model_path=CTR_TFLITE_PATH, num_threads=1)
+            itp.allocate_tensors()
+            self._tls.interpreter = itp
+        return itp
+
+    def _predict_ctr(self, X):
+        if not self.use_tflite:
+            return self._ctr_fn(tf.constant(X)).numpy().ravel()
+        itp = self._interpreter()
+        inp = itp.get_input_details()[0]
+        if tuple(inp["shape"]) != X.shape:
+            itp.resize_tensor_input(inp["index"], X.shape)
+            itp.allocate_tensors()
+        itp.set_tensor(inp["index"], X)
+        itp.invoke()
+        return itp.get_tensor(itp.get_output_details()[0]["index"]).ravel()
+
+    async def _score(self, X):
+        """Ensemble scores for the rows of ``X`` (n x [impressions, hour_of_day])."""
+        loop = asyncio.get_running_loop()
+        score_lm, score_ctr = await asyncio.gather(
+            loop.run_in_executor(
+                self._pool,
+                lambda: self.lm.predict(
+                    X, raw_score=True, num_threads=1, predict_disable_shape_check=True
+                ),
+            ),
+            loop.run_in_executor(self._pool, self._predict_ctr, X),
+        )
+        # LambdaMART scores are unbounded; squash them into the CTR's [0, 1] range
+        return 0.5*_sigmoid(score_lm) + 0.5*score_ctr
+
+    @staticmethod
+    def _context_row(request):
+        return [request.context_features.get("impressions", 1.0),
+                request.context_features.get("hour_of_day", 0.0)]
+
+    @staticmethod
+    def _demo_response(request):
+        # DEMO MODE: Generate random but deterministic scores from a
+        # per-request generator (str hash() is salted per process)
+        items = list(request.item_ids)
+        seed = int.from_bytes(
+            hashlib.blake2b(request.user_id.encode(), digest_size=8).digest(), "little"
+        )
+        scores = np.random.default_rng(seed).random(len(items), dtype=np.float32)
+        response = feed_ranker_pb2.RankResponse()
+        for i in rank_order(scores, request.top_k):
+            response.ranked_items.add(item_id=items[i], score=float(scores[i]))
+        return response
+
+    @staticmethod
+    def _broadcast_response(request, score):
+        # The only features are context features shared by every item, so all
+        # items score the same. Ties keep the request order, so no sort is needed.
         items = request.item_ids
-        
-        if self.demo_mode:
-            # DEMO MODE: Generate random but deterministic scores
-            np.random.seed(hash(request.user_id) % (2**32))
-            scores = np.random.random(len(items))
-        else:
-            # PRODUCTION MODE: Use trained models
-            # build feature matrix for each item
-            X = []
-            for item in items:
-                imp = request.context_features.get("impressions", 1.0)
-                hr  = request.context_features.get("hour_of_day", 0.0)
-                X.append([imp, hr])
-            X = np.array(X)
-            # score with both models and combine
-            score_lm  = self.lm.predict(X)
-            score_ctr = self.ctr.predict(X).flatten()
-            scores = 0.5*score_lm + 0.5*score_ctr
-
-        # sort
-        ranked = sorted(zip(items, scores), key=lambda x: x[1], reverse=True)
+        k = request.top_k if 0 < request.top_k < len(items) else len(items)
         response = feed_ranker_pb2.RankResponse()
-        for iid, sc in ranked:
-            response.ranked_items.add(item_id=iid, score=float(sc))
+        for iid in items[:k]:
+            response.ranked_items.add(item_id=iid, score=score)
         return response
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    async def Rank(self, request, context):
+        if self.demo_mode:
+            return self._demo_response(request)
+        # PRODUCTION MODE: predict one row and broadcast it to every item
+        X1 = np.array([self._context_row(request)], dtype=np.float32)
+        combined = float((await self._score(X1))[0])
+        return self._broadcast_response(request, combined)
+
+    async def _rank_many(self, requests):
+        if self.demo_mode:
+            return [self._demo_response(r) for r in requests]
+        # one feature row per request, scored in a single call to each model
+        X = np.array([self._context_row(r) for r in requests], dtype=np.float32)
+        scores = await self._score(X)
+        return [self._broadcast_response(r, float(s)) for r, s in zip(requests, scores)]
+
+    async def RankBatch(self, request_iterator, context):
+        # Pump the stream into a queue so the batching window can time out
+        # on queue.get() without cancelling a read on the stream itself.
+        queue = asyncio.Queue()
+
+        async def pump():
+            async for request in request_iterator:
+                await queue.put(request)
+            await queue.put(None)
+
+        reader = asyncio.create_task(pump())
+        loop = asyncio.get_running_loop()
+        try:
+            done = False
+            while not done:
+                request = await queue.get()
+                if request is None:
+                    break
+                batch = [request]
+                deadline = loop.time() + BATCH_WINDOW_SECONDS
+                try:
+                    while len(batch) < BATCH_MAX_REQUESTS:
+                        request = await asyncio.wait_for(queue.get(), deadline - loop.time())
+                        if request is None:
+                            done = True
+                            break
+                        batch.append(request)
+                except asyncio.TimeoutError:
+                    pass
+                for response in await self._rank_many(batch):
+                    yield response
+        finally:
+            reader.cancel()
+
+async def serve():
+    server = grpc.aio.server(options=[("grpc.so_reuseport", 1)])
     feed_ranker_pb2_grpc.add_FeedRankerServicer_to_server(FeedRankerServicer(), server)
     server.add_insecure_port("[::]:50051")
-    server.start()
+    await server.start()
     print("gRPC server running on :50051")
-    server.wait_for_termination()
+    await server.wait_for_termination()
 
 if __name__ == "__main__":
-    serve()
+    asyncio.run(serve())
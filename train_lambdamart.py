@@ -5,11 +5,15 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import ndcg_score
 
 def load_data(path):
-    df = pd.read_parquet(path)
+    df = pd.read_parquet(
+        path,
+        columns=["impressions", "avg_hour", "ctr", "user_id", "imp_id"],
+        engine="pyarrow",
+    )
     X = df[["impressions", "avg_hour"]]  # add any other features
     y = df["ctr"]
     # group/query grouping key for ranking
-    qid = df["user_id"].astype(str) + "_" + df["session_id"].astype(str)
+    qid = df["user_id"].astype(str) + "_" + df["imp_id"].astype(str)
     return X, y, qid
 
 def main(feat_path, model_out):